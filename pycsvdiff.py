@@ -28,24 +28,52 @@
 ######################################################################
 import os
 import sys
-import pprint
 import csv
-import optparse
-import StringIO
+import difflib
+import itertools
+import mmap
+import multiprocessing
+import operator
+import argparse
+import contextlib
+import io
+import shutil
+import tempfile
 import unittest
 
+# Files are read through a 1 MiB buffer so that csv.reader's C tokenizer
+# works on large blocks instead of going back to the OS every 8 KiB.
+READ_BUFFER_SIZE = 1 << 20
+
+# Below this many rows, --jobs diffs in-process rather than starting workers
+PARALLEL_MIN_ROWS = 50000
+
+# Below this many bytes, --jobs parses a file in-process
+PARALLEL_MIN_BYTES = 1 << 23
+
+# --hash-diff falls back to difflib beyond this many inserted and deleted
+# rows, where the O(ND) alignment gets slower than difflib's heuristics
+MYERS_MAX_EDITS = 2000
+
+# Diff output is written in batches of this many lines
+OUTPUT_BUFFER_LINES = 1024
 ################################################################
 #
 #                    Generic Table Diffing Code
 #
 ################################################################
 class Table(object):
-    def __init__(self, rows, fields=None, label_first_row=False):
+    __slots__ = ("label_first_row", "rows", "fields", "columns")
+
+    def __init__(self, rows, fields=None, label_first_row=False,
+                 columnar=False):
         """
         rows (iterator): something to yield rows like csv.reader
         fields (tuple): an optional set of field names. if ommitted,
             the fields will be auto-named with their field number.
         label_first_row (bool): the first row represents field labels
+        columnar (bool): read all rows into memory and also store them
+            column-wise in self.columns, one tuple per field
 
         The sigil '@' is used to represent fields that have been auto-named
         with their field number. It is also used by --skipped-fields and
@@ -56,18 +84,27 @@ class Table(object):
         if fields:
             self.fields = fields
         else:
-            peek = iter(rows).next()
-            if label_first_row:
+            rows = iter(rows)
+            peek = next(rows, None)
+            if peek is None:
+                # Nothing to read, not even a label row
+                self.fields = ()
+                self.rows = rows
+            elif label_first_row:
                 self.fields = tuple(peek)
+                self.rows = rows
             else:
-                fieldnames = map(lambda i: "@%i" % i, range(len(peek)))
-                self.fields = tuple(fieldnames)
+                self.fields = tuple(["@%i" % i for i in range(len(peek))])
                 # Put the peeked value back into the stream
-                def _iter():
-                    yield peek
-                    for row in rows:
-                        yield row
-                self.rows = _iter()
+                self.rows = itertools.chain([peek], rows)
+        self.columns = None
+        if columnar:
+            self.rows = list(self.rows)
+            # zip would cut every column to the shortest row, so a ragged
+            # table keeps columns=None and is diffed row by row
+            width = len(self.fields)
+            if all(len(row) == width for row in self.rows):
+                self.columns = list(zip(*self.rows))
 
 
 class TableDiffer(object):
@@ -90,14 +127,26 @@ class TableDiffer(object):
         deleted u indexes table_a's rows, u > len(table_b's rows)
         changed a[u] != b[u] which means that:
 
-            there exists i such that a[u][i] != b[u][i] 
+            there exists i such that a[u][i] != b[u][i]
+
+    Every added, deleted or changed row sets difference_detected,
+    whichever of the row diffing methods found it.
     """
+    __slots__ = ("table_a", "table_b", "difference_detected", "verbosity",
+                 "jobs", "hash_diff", "key_fields", "ignore_case",
+                 "ignore_order",
+                 "skipped_fields", "mapping", "_compare", "_bi_mapping",
+                 "_plans", "_differs", "_outbuf", "_value_prefixes")
+
     def __init__(self, table_a=None, table_b=None, 
                  skipped_fields=None,
                  verbosity=2,
                  ignore_case=False,
                  only_fields=None,
-                 ignore_order=False):
+                 ignore_order=False,
+                 jobs=1,
+                 hash_diff=False,
+                 key_fields=None):
         """
         table_a (Table): first table
         table_b (Table): second table
@@ -108,12 +157,23 @@ class TableDiffer(object):
         only_fields (set): only use these fields when comparing
         ignore_order (bool): if tables are labeled then a mapping between fields can
             be established so order can be ignored
+        jobs (int): number of worker processes to diff rows with
+        hash_diff (bool): align rows by content before diffing them, so
+            inserted and deleted rows don't show up as changed rows
+        key_fields (list): field numbers whose values identify a row; rows
+            are matched up by key instead of by position
         """
         self.table_a = table_a
         self.table_b = table_b
         self.difference_detected = False
         self.verbosity = verbosity
+        self.jobs = jobs
+        self.hash_diff = hash_diff
+        self.key_fields = list(key_fields or [])
+        # Lines waiting to be written, keyed by output file
+        self._outbuf = {}
         self.ignore_case = ignore_case
+        self._compare = _cmp_ci if ignore_case else _cmp_eq
         self.ignore_order = ignore_order
         if ignore_order:
             assert table_a.label_first_row == table_b.label_first_row == True
@@ -121,11 +181,11 @@ class TableDiffer(object):
         all_fields = set(range(max(len(table_a.fields), len(table_b.fields))))
         assert not (skipped_fields and only_fields)
         if only_fields:
-            skipped_fields = all_fields - set(only_fields)
+            skipped_fields = frozenset(all_fields - set(only_fields))
         elif skipped_fields:
-            skipped_fields = set(skipped_fields)
+            skipped_fields = frozenset(skipped_fields)
         else:
-            skipped_fields = set()
+            skipped_fields = frozenset()
             
         self.skipped_fields = skipped_fields
         # If we are using labels for fields, then create a mapping between
@@ -133,36 +193,121 @@ class TableDiffer(object):
         assert table_a.label_first_row == table_b.label_first_row
         self.mapping = set()
         if table_a.label_first_row:
+            # Index of each label in table_b; the first one wins if a label
+            # is repeated
+            index_b = {}
+            for j, field_b in enumerate(table_b.fields):
+                index_b.setdefault(field_b, j)
             for i, field_a in enumerate(table_a.fields):
-                for j, field_b in enumerate(table_b.fields):
-                    if field_a == field_b:
-                        self.mapping.add((i, j))
-                        break
+                if field_a in index_b:
+                    self.mapping.add((i, index_b[field_a]))
+        # Bi-directional form of the mapping, built once for all rows
+        if ignore_order:
+            self._bi_mapping = _build_bidi(self.mapping)
+        else:
+            self._bi_mapping = {}
+        # Start of the line pprint_value_changed prints, for each field
+        self._value_prefixes = ["Value in field '%s' changed: " % (field,)
+                                for field in table_a.fields]
+        # Compare plans for diff_rows, and the row differs compiled from
+        # them, keyed by row width
+        self._plans = {}
+        self._differs = {}
                     
             
+    def _compare_plan(self, width):
+        """
+        width (int): length of both rows being compared
+        Returns: list of (i, j) pairs; value i of a row in table_a is
+            compared against value j of a row in table_b
+
+        Skipped fields and the --ignore-order mapping are resolved once per
+        row width here, so diff_rows doesn't redo that work for every cell.
+        """
+        try:
+            return self._plans[width]
+        except KeyError:
+            pass
+        mapping = self._bi_mapping
+        plan = []
+        for i in range(width):
+            if i in self.skipped_fields:
+                continue
+            j = mapping.get(i, i)
+            if j < width:
+                plan.append((i, j))
+        self._plans[width] = plan
+        return plan
+
+    def _row_differ(self, width):
+        """
+        width (int): length of both rows being compared
+        Returns: function(row_a, row_b) returning the list of
+            (i, value_a, value_b) for the values that differ
+
+        The compare plan is unrolled into straight-line source and compiled,
+        so skipped fields cost nothing and there is no per-cell loop.
+        """
+        try:
+            return self._differs[width]
+        except KeyError:
+            pass
+        if self._compare is _cmp_eq:
+            test = "x[%i] != y[%i]"
+        else:
+            test = "not compare(x[%i], y[%i])"
+        lines = ["def diff(x, y, compare=compare):",
+                 "    changed = []"]
+        for i, j in self._compare_plan(width):
+            lines.append("    if %s:" % (test % (i, j)))
+            lines.append("        changed.append((%i, x[%i], y[%i]))"
+                         % (i, i, j))
+        lines.append("    return changed")
+        namespace = {"compare": self._compare}
+        exec("\n".join(lines), namespace)
+        differ = self._differs[width] = namespace["diff"]
+        return differ
+
+    def _diff_ragged_row(self, row_a, row_b):
+        """
+        Same as the row differ, but for rows of different lengths: the plan
+        for the wider row is used, and a value only one row has is
+        reported against nil unless its field is skipped
+        Returns: list of (i, value_a, value_b)
+        """
+        len_a, len_b = len(row_a), len(row_b)
+        compare = self._compare
+        changed = []
+        for i, j in self._compare_plan(max(len_a, len_b)):
+            x = row_a[i] if i < len_a else nil
+            y = row_b[j] if j < len_b else nil
+            # nil never goes through compare, where it would be folded
+            # to the string "nil" under --ignore-case
+            if x is nil or y is nil or not compare(x, y):
+                changed.append((i, x, y))
+        return changed
+
     def _diff_row(self, row_a, row_b):
         """ 
         row_a (iterable): first row to diff
         row_b (iterable): second row to diff
         Returns: tuple representing differences
         """
-        def comparator(p, q):
-            if self.ignore_case:
-                return str(p).lower() == str(q).lower()
-            else:
-                return p == q
-        
-        mapping = self.mapping if self.ignore_order else None
-        diffs = diff_seq_by_index(row_a, row_b, 
-                                  cmp=comparator,
-                                  skip=lambda i: i in self.skipped_fields,
-                                  mapping=mapping)
-        
-        added = [(i, y) for i, x, y in diffs if x is nil]
-        deleted = [(i, x) for i, x, y in diffs if y is nil]
-        changed = [(i, x, y) for i, x, y in diffs 
-                   if x is not nil and y is not nil]
-        if any([added, deleted, changed]):
+        added, deleted, changed = [], [], []
+        if not self._bi_mapping and len(row_a) == len(row_b):
+            # Nothing can be added or deleted, and equal rows can be
+            # dismissed with one C-level sequence comparison
+            row_a, row_b = tuple(row_a), tuple(row_b)
+            if row_a == row_b:
+                return added, deleted, changed
+            # The row differ has skipped fields masked out already
+            changed = self._row_differ(len(row_a))(row_a, row_b)
+        else:
+            diff_seq_by_index_into(row_a, row_b, added, deleted, changed,
+                                   cmp=self._compare,
+                                   skip_set=self.skipped_fields,
+                                   mapping=self._bi_mapping)
+        if added or deleted or changed:
             self.difference_detected = True
         return added, deleted, changed
 
@@ -174,75 +319,419 @@ class TableDiffer(object):
         Iterates over rows in both tables in order to diff them
         Returns: Yields tuple representing row differences
         """
-        a = iter(self.table_a.rows)
-        b = iter(self.table_b.rows)
-        i = 0
-        while True:
-            try:
-                x = a.next()
-            except StopIteration:
-                x = nil
-            try:
-                y = b.next()
-            except StopIteration:
-                y = nil
-            i += 1
-            if x is nil and y is nil:
-                break
-            elif y is nil:
-                yield "deleted", i-1, x
+        # Without skipped fields, a field mapping or case folding, a row
+        # pair can be compared wholesale and only unequal rows need to be
+        # walked cell by cell.
+        if self.skipped_fields or self.ignore_order or self.ignore_case:
+            return self._diff_rows_planned()
+        return self._diff_rows_plain()
+
+    def _diff_rows_plain(self):
+        pairs = itertools.zip_longest(self.table_a.rows, self.table_b.rows,
+                                      fillvalue=nil)
+        for i, (x, y) in enumerate(pairs):
+            if y is nil:
+                self.difference_detected = True
+                yield "deleted", i, x
+            elif x is nil:
+                self.difference_detected = True
+                yield "added", i, y
+            elif x != y:
+                # Only unequal rows get here. Field counts were checked by
+                # diff_fields, but a ragged row can still be short, so
+                # its missing values are compared against nil
+                values_changed = [(j, p, q) for j, (p, q)
+                                  in enumerate(itertools.zip_longest(
+                                      x, y, fillvalue=nil))
+                                  if p != q]
+                if values_changed:
+                    self.difference_detected = True
+                    yield "changed", i, x, y, values_changed
+
+    def _diff_rows_planned(self):
+        # Rows that are equal position by position can only differ once
+        # --ignore-order maps values to other positions
+        positional = not self._bi_mapping
+        width = differ = None
+        pairs = itertools.zip_longest(self.table_a.rows, self.table_b.rows,
+                                      fillvalue=nil)
+        for i, (x, y) in enumerate(pairs):
+            if y is nil:
+                self.difference_detected = True
+                yield "deleted", i, x
             elif x is nil:
-                yield "added", i-1, y
+                self.difference_detected = True
+                yield "added", i, y
+            elif positional and x == y:
+                continue
             else:
-                assert len(x) == len(y)
-                _, _, values_changed = self._diff_row(x, y)
+                if len(x) != len(y):
+                    # A ragged row, or a column only one table has
+                    values_changed = self._diff_ragged_row(x, y)
+                else:
+                    if len(x) != width:
+                        width = len(x)
+                        differ = self._row_differ(width)
+                    values_changed = differ(x, y)
                 if values_changed:
-                    yield "changed", i-1, x, y, values_changed
+                    self.difference_detected = True
+                    yield "changed", i, x, y, values_changed
+
+    def diff_rows_columnar(self):
+        """
+        Same as diff_rows, but for tables built with columnar=True
+
+        Whole columns are compared first, so a field that is unchanged
+        across the table costs a single tuple comparison; only the columns
+        that differ are walked row by row. Tables without columns (ragged
+        ones) or with different numbers of them are left to diff_rows.
+        Returns: Yields tuple representing row differences
+        """
+        if self.table_a.columns is None or self.table_b.columns is None or \
+           len(self.table_a.columns) != len(self.table_b.columns):
+            yield from self.diff_rows()
+            return
+        rows_a = self.table_a.rows
+        rows_b = self.table_b.rows
+        n = min(len(rows_a), len(rows_b))
+        cols_a = [col[:n] for col in self.table_a.columns]
+        cols_b = [col[:n] for col in self.table_b.columns]
+        if self.ignore_case:
+            # Fold case once per column instead of on every comparison
+            keys_a = [tuple(map(_lower, col)) for col in cols_a]
+            keys_b = [tuple(map(_lower, col)) for col in cols_b]
+        else:
+            keys_a, keys_b = cols_a, cols_b
+
+        cols_changed = diff_seq_by_index(keys_a, keys_b,
+                                         skip_set=self.skipped_fields,
+                                         mapping=self._bi_mapping)
+        values_changed = {}
+        for i, key_a, key_b in cols_changed:
+            if key_a is nil or key_b is nil:
+                continue
+            col_a = cols_a[i]
+            col_b = cols_b[self._bi_mapping.get(i, i)]
+            # The inequality mask is computed and filtered entirely in C;
+            # only the rows that actually differ reach the Python loop
+            mask = map(operator.ne, key_a, key_b)
+            for u in itertools.compress(itertools.count(), mask):
+                values_changed.setdefault(u, []).append(
+                    (i, col_a[u], col_b[u]))
+        if values_changed:
+            self.difference_detected = True
+
+        for u in sorted(values_changed):
+            yield "changed", u, rows_a[u], rows_b[u], values_changed[u]
+        for u in range(n, len(rows_a)):
+            self.difference_detected = True
+            yield "deleted", u, rows_a[u]
+        for v in range(n, len(rows_b)):
+            self.difference_detected = True
+            yield "added", v, rows_b[v]
+
+    def _row_ids(self, rows, side, ids):
+        """
+        rows (list): rows from table_a (side 0) or table_b (side 1)
+        ids (dict): row keys seen so far, mapped to their ids; new keys
+            are added with the next free id
+        Returns: list with an int id for each row; two rows get the same
+            id exactly when diffing them would report no changed values
+        """
+        ignore_case = self.ignore_case
+        width = None
+        result = []
+        append = result.append
+        for row in rows:
+            if len(row) != width:
+                width = len(row)
+                columns = [pair[side] for pair in self._compare_plan(width)]
+                if len(columns) > 1:
+                    key = operator.itemgetter(*columns)
+                else:
+                    # itemgetter returns a bare value for a single index
+                    key = lambda row, columns=columns: tuple([row[c] for c
+                                                              in columns])
+            k = key(row)
+            if ignore_case:
+                k = tuple([_lower(v) for v in k])
+            append(ids.setdefault(k, len(ids)))
+        return result
+
+    def diff_rows_aligned(self):
+        """
+        Same as diff_rows, but rows are matched up by content rather than
+        by position. Both tables are read into memory and each row is
+        reduced to an int id (see _row_ids); the id sequences are
+        aligned with myers_opcodes, which finds the shortest edit script
+        in time proportional to how many rows differ. Tables that need
+        more than MYERS_MAX_EDITS row edits fall back to
+        difflib.SequenceMatcher, which stays fast on very different
+        inputs. Rows that line up within a replaced block are diffed
+        value by value, the rest are reported as added or deleted.
+        Returns: Yields tuple representing row differences
+        """
+        rows_a = list(self.table_a.rows)
+        rows_b = list(self.table_b.rows)
+        # Each distinct row is interned as a small int, so the scans and
+        # the alignment below compare ints instead of walking tuples. The
+        # dict checks full equality, so different rows never share an id.
+        ids = {}
+        keys_a = self._row_ids(rows_a, 0, ids)
+        keys_b = self._row_ids(rows_b, 1, ids)
+        del ids
+        # Files being diffed are usually mostly the same, so trim the rows
+        # they share at either end before aligning what's left. Both scans
+        # stop at the first unequal pair without leaving C.
+        n = min(len(keys_a), len(keys_b))
+        unequal = itertools.compress(itertools.count(),
+                                     map(operator.ne, keys_a, keys_b))
+        prefix = next(unequal, n)
+        unequal = itertools.compress(itertools.count(),
+                                     map(operator.ne,
+                                         reversed(keys_a),
+                                         reversed(keys_b)))
+        suffix = min(next(unequal, n), n - prefix)
+        keys_a = keys_a[prefix:len(keys_a) - suffix]
+        keys_b = keys_b[prefix:len(keys_b) - suffix]
+        opcodes = myers_opcodes(keys_a, keys_b, max_edits=MYERS_MAX_EDITS)
+        if opcodes is None:
+            matcher = difflib.SequenceMatcher(None, keys_a, keys_b,
+                                              autojunk=False)
+            opcodes = matcher.get_opcodes()
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag == "equal":
+                continue
+            i1, i2, j1, j2 = i1 + prefix, i2 + prefix, j1 + prefix, j2 + prefix
+            n = min(i2 - i1, j2 - j1)
+            for u, v in zip(range(i1, i1 + n), range(j1, j1 + n)):
+                x, y = rows_a[u], rows_b[v]
+                # As in diff_rows_keyed, the plan for the wider row reads
+                # every compared column; a row lacking one can't be paired
+                try:
+                    values_changed = self._row_differ(
+                        max(len(x), len(y)))(x, y)
+                except IndexError:
+                    self.difference_detected = True
+                    yield "deleted", u, x
+                    yield "added", v, y
+                    continue
+                if values_changed:
+                    self.difference_detected = True
+                    yield "changed", u, x, y, values_changed
+            for u in range(i1 + n, i2):
+                self.difference_detected = True
+                yield "deleted", u, rows_a[u]
+            for v in range(j1 + n, j2):
+                self.difference_detected = True
+                yield "added", v, rows_b[v]
+
+    def diff_rows_keyed(self):
+        """
+        Same as diff_rows, but rows are matched up by the values of the key
+        fields rather than by position, so the tables may be in any order.
+        table_b is indexed by key in a dict and table_a is streamed past
+        it. Rows sharing a key are paired in the order they appear.
+        Changed and deleted rows are yielded in table_a's order with
+        table_a's row numbers, followed by added rows in table_b's order
+        with table_b's row numbers. A row too short to hold the key, or to
+        be compared with the row its key matched, is reported as unmatched.
+        Returns: Yields tuple representing row differences
+        """
+        columns_a = self.key_fields
+        columns_b = [self._bi_mapping.get(i, i) for i in columns_a]
+        # A single key field gives bare values rather than 1-tuples, the
+        # same on both sides
+        key_a = operator.itemgetter(*columns_a)
+        key_b = operator.itemgetter(*columns_b)
+        if self.ignore_case:
+            if len(columns_a) == 1:
+                fold = _lower
+            else:
+                fold = lambda k: tuple(map(_lower, k))
+            key_a = lambda row, key=key_a: fold(key(row))
+            key_b = lambda row, key=key_b: fold(key(row))
+
+        positional = not self._bi_mapping
+        rows_b = list(self.table_b.rows)
+        # Row numbers in table_b for each key, last first so that pop()
+        # hands them out in order
+        index_b = {}
+        for v in range(len(rows_b) - 1, -1, -1):
+            try:
+                k = key_b(rows_b[v])
+            except IndexError:
+                continue
+            index_b.setdefault(k, []).append(v)
+        matched = [False] * len(rows_b)
+        width = differ = None
+        for u, x in enumerate(self.table_a.rows):
+            try:
+                found = index_b.get(key_a(x))
+            except IndexError:
+                found = None
+            if not found:
+                self.difference_detected = True
+                yield "deleted", u, x
+                continue
+            v = found[-1]
+            y = rows_b[v]
+            if positional and x == y:
+                found.pop()
+                matched[v] = True
+                continue
+            # The plan for the wider row reads every column either row has,
+            # bar skipped ones; a row missing one of those can't be compared
+            if max(len(x), len(y)) != width:
+                width = max(len(x), len(y))
+                differ = self._row_differ(width)
+            try:
+                values_changed = differ(x, y)
+            except IndexError:
+                # y stays available for a later row with the same key
+                self.difference_detected = True
+                yield "deleted", u, x
+                continue
+            found.pop()
+            matched[v] = True
+            if values_changed:
+                self.difference_detected = True
+                yield "changed", u, x, y, values_changed
+        for v in itertools.compress(range(len(rows_b)),
+                                    [not m for m in matched]):
+            self.difference_detected = True
+            yield "added", v, rows_b[v]
+
+    def diff_rows_parallel(self, jobs, min_rows=None):
+        """
+        Same as diff_rows, but reads both tables into memory and splits the
+        rows they have in common into chunks that are diffed by a pool of
+        worker processes
+        jobs (int): number of worker processes
+        min_rows (int): tables with fewer common rows than this are diffed
+            in this process, where starting workers would cost more than
+            it saves (default: PARALLEL_MIN_ROWS)
+        Returns: Yields tuple representing row differences
+        """
+        if min_rows is None:
+            min_rows = PARALLEL_MIN_ROWS
+        rows_a = list(self.table_a.rows)
+        rows_b = list(self.table_b.rows)
+        n = min(len(rows_a), len(rows_b))
+        settings = (self.table_a.fields, self.table_b.fields,
+                    self.table_a.label_first_row, self.skipped_fields,
+                    self.ignore_case, self.ignore_order)
+        if jobs > 1 and n >= min_rows:
+            chunksize = max(1, n // (4 * jobs))
+            tasks = [(settings, u, rows_a[u:u+chunksize], rows_b[u:u+chunksize])
+                     for u in range(0, n, chunksize)]
+            pool = multiprocessing.Pool(jobs)
+            try:
+                results = pool.map(_diff_chunk, tasks)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            results = [_diff_chunk((settings, 0, rows_a[:n], rows_b[:n]))]
+
+        for difference_detected, row_diffs in results:
+            if difference_detected:
+                self.difference_detected = True
+            for row_diff in row_diffs:
+                yield row_diff
+        for u in range(n, len(rows_a)):
+            self.difference_detected = True
+            yield "deleted", u, rows_a[u]
+        for v in range(n, len(rows_b)):
+            self.difference_detected = True
+            yield "added", v, rows_b[v]
 
     def output(self, data, out=sys.stdout, indent=0, verbosity=2):
+        """
+        Output is buffered per file and written OUTPUT_BUFFER_LINES lines
+        at a time; the pprint_* methods that print whole sections flush
+        when they are done, anything else needs an explicit flush().
+        """
         if self.verbosity >= verbosity:
-            print >>out, " " * indent + data
+            lines = self._outbuf.setdefault(out, [])
+            lines.append(" " * indent + data if indent else data)
+            if len(lines) >= OUTPUT_BUFFER_LINES:
+                self.flush(out)
+
+    def flush(self, out=None):
+        """
+        out (file): file to write buffered output to, or None for all
+        """
+        if out is None:
+            outs = list(self._outbuf)
+        else:
+            outs = [out]
+        for out in outs:
+            lines = self._outbuf.pop(out, None)
+            if lines:
+                out.write("\n".join(lines) + "\n")
         
     def pprint_value_changed(self, value_changed, out=sys.stdout,
                              indent=0):
-        def output(data, out=out, indent=indent, verbosity=2):
-            return self.output(data, out=out, indent=indent, 
-                               verbosity=verbosity)
         i, x, y = value_changed
-        field = self.table_a.fields[i]
-        output("Value in field '%s' changed: '%s' -> '%s'" % (field, x, y))
+        if i < len(self._value_prefixes):
+            prefix = self._value_prefixes[i]
+        else:
+            # A ragged row can have values past the last field
+            prefix = "Value in field '@%i' changed: " % i
+        self.output(prefix + "'%s' -> '%s'" % (x, y), out=out, indent=indent)
 
     def pprint_values_changed(self, values_changed, out=sys.stdout, 
                               indent=0):
         for value_changed in values_changed:
             self.pprint_value_changed(value_changed, out=out, indent=indent)
 
+    def _pprint_row_added(self, row_diff, out, indent):
+        _, i, row = row_diff
+        self.output("Row %i added" % i, out=out, indent=indent, verbosity=1)
+        self.output(repr(row), out=out, indent=indent, verbosity=1)
+
+    def _pprint_row_deleted(self, row_diff, out, indent):
+        _, i, row = row_diff
+        self.output("Row %i deleted" % i, out=out, indent=indent,
+                    verbosity=1)
+        self.output(repr(row), out=out, indent=indent, verbosity=1)
+
+    def _pprint_row_changed(self, row_diff, out, indent):
+        _, i, row_a, row_b, values_changed = row_diff
+        self.output("Row %i changed" % i, out=out, indent=indent,
+                    verbosity=1)
+        self.pprint_values_changed(values_changed, out=out, 
+                                   indent=indent+4)
+
+    # Printer for each diff tag, looked up once per row diff
+    _row_printers = {"added": _pprint_row_added,
+                     "deleted": _pprint_row_deleted,
+                     "changed": _pprint_row_changed}
+
     def pprint_row_diff(self, row_diff, out=sys.stdout, indent=0):
-        def output(data, out=out, indent=indent, verbosity=1):
-            return self.output(data, out=out, indent=indent, 
-                               verbosity=verbosity)
-           
         tag = row_diff[0]
-        if tag == "added":
-            _, i, row = row_diff
-            output("Row %i added" %i)
-            output(pprint.pformat(row))
-        elif tag == "deleted":
-            _, i, row = row_diff
-            output("Row %i deleted" %i)
-            output(pprint.pformat(row))
-        elif tag == "changed":
-            _, i, row_a, row_b, values_changed = row_diff
-            output("Row %i changed" %i, out=out, indent=indent)
-            self.pprint_values_changed(values_changed, out=out, 
-                                       indent=indent+4)
-        else:
+        printer = self._row_printers.get(tag)
+        if printer is None:
             raise Exception("Unknown diff tag \"%s\"" % tag)
-        output("-" * 50, verbosity=2)
+        printer(self, row_diff, out, indent)
+        self.output("-" * 50, out=out, indent=indent, verbosity=2)
 
     def pprint_row_diffs(self, out=sys.stdout, indent=0):
-        for row_diff in self.diff_rows():
+        if self.key_fields:
+            row_diffs = self.diff_rows_keyed()
+        elif self.hash_diff:
+            row_diffs = self.diff_rows_aligned()
+        elif self.table_a.columns is not None and \
+           self.table_b.columns is not None:
+            row_diffs = self.diff_rows_columnar()
+        elif self.jobs > 1:
+            row_diffs = self.diff_rows_parallel(self.jobs)
+        else:
+            row_diffs = self.diff_rows()
+        for row_diff in row_diffs:
             self.pprint_row_diff(row_diff, out=out, indent=indent)
+        self.flush()
 
     def pprint_field_diffs(self, out=sys.stdout, indent=0):
         def output(data, out=out, indent=indent, verbosity=1):
@@ -257,22 +746,46 @@ class TableDiffer(object):
         for x in changed:
             _, old, new = x
             output("Field changed: '%s' -> '%s'" % (old, new))
+        self.flush()
 
         return added, deleted, changed
 
     def pprint_diff(self, out=sys.stdout, indent=0):
         field_diffs = self.pprint_field_diffs(out=out, indent=indent)
         if any(field_diffs):
-            self.output("Fields changed, skipping row diff!")
+            self.output("Fields changed, skipping row diff!", out=out,
+                        indent=indent)
+            self.flush()
         else:
             self.pprint_row_diffs(out=out, indent=indent)
 
 
+def _diff_chunk(task):
+    """
+    Worker for TableDiffer.diff_rows_parallel; diffs one chunk of rows
+    task (tuple): (settings, base, rows_a, rows_b) where base is the index
+        of the chunk's first row
+    Returns: (difference_detected, list of row differences)
+    """
+    settings, base, rows_a, rows_b = task
+    (fields_a, fields_b, label_first_row, skipped_fields, ignore_case,
+     ignore_order) = settings
+    table_a = Table(rows_a, fields=fields_a, label_first_row=label_first_row)
+    table_b = Table(rows_b, fields=fields_b, label_first_row=label_first_row)
+    differ = TableDiffer(table_a, table_b, skipped_fields=skipped_fields,
+                         ignore_case=ignore_case, ignore_order=ignore_order)
+    row_diffs = [(row_diff[0], row_diff[1] + base) + row_diff[2:]
+                 for row_diff in differ.diff_rows()]
+    return differ.difference_detected, row_diffs
+
+
 class NilType(object):
     """
     Nil is a singleton used to distinguish between a value being equal to
     None and value not being present.
     """
+    __slots__ = ()
+
     def __repr__(self):
         return "nil"
     __str__ = __repr__
@@ -280,15 +793,38 @@ class NilType(object):
 
 nil = NilType()
 
+def _cmp_eq(p, q):
+    return p == q
+
+def _lower(p):
+    return (p if type(p) is str else str(p)).lower()
+
+def _cmp_ci(p, q):
+    p = p if type(p) is str else str(p)
+    q = q if type(q) is str else str(q)
+    return p.lower() == q.lower()
+
+def _build_bidi(mapping):
+    """
+    mapping (iterable of tuples): (i, j) index pairs
+    Returns: dict mapping each i to j and each j to i
+    """
+    mapping = set(mapping or [])
+    # Convert tuple to bi-directional mapping in dict form
+    return dict(mapping | set(map(lambda x: tuple(reversed(x)), mapping))) 
+
 def diff_seq_by_index(a, b, 
                       cmp=lambda p, q: p == q, 
                       mapping=None,
-                      skip=lambda i: False):
+                      skip=None,
+                      skip_set=frozenset()):
     """
     a and b (indexable, finite, iterables)
     cmp(func): a user-defined comparator function
-    mapping (set of tuples): map a indices on to b
+    mapping (set of tuples or dict): map a indices on to b; a dict is
+        taken to be already bi-directional (see _build_bidi)
     skip (func): allows user to skip elements
+    skip_set (frozenset): indices to skip; cheaper than passing skip
     
     Returns: list of diff codes
     
@@ -305,29 +841,183 @@ def diff_seq_by_index(a, b,
     I am not positive, but I think this basic approach was inspired by 
     a recipe I saw by Jim Baker (he called nil NoneType).
     """
-    mapping = set(mapping or [])
-    # Convert tuple to bi-directional mapping in dict form
-    mapping = dict(mapping | set(map(lambda x: tuple(reversed(x)), mapping))) 
-    diffs = []
-    for i in xrange(max(len(a), len(b))):
-        if skip(i):
+    added, deleted, changed = [], [], []
+    diff_seq_by_index_into(a, b, added, deleted, changed,
+                           cmp=cmp, mapping=mapping, skip=skip,
+                           skip_set=skip_set)
+    diffs = [(i, nil, y) for i, y in added]
+    diffs.extend((i, x, nil) for i, x in deleted)
+    diffs.extend(changed)
+    diffs.sort(key=operator.itemgetter(0))
+    return diffs
+
+def diff_seq_by_index_into(a, b, added, deleted, changed,
+                           cmp=lambda p, q: p == q, 
+                           mapping=None,
+                           skip=None,
+                           skip_set=frozenset()):
+    """
+    Same as diff_seq_by_index, but each difference is appended straight
+    onto the caller's lists rather than returned as a diff code:
+
+            added   (list): gets (i, y)
+            deleted (list): gets (i, x)
+            changed (list): gets (i, x, y)
+    """
+    if not isinstance(mapping, dict):
+        mapping = _build_bidi(mapping)
+    # Bind everything the loop touches to locals (LOAD_FAST)
+    _nil = nil
+    _mget = mapping.get
+    _add, _delete, _change = added.append, deleted.append, changed.append
+    len_a, len_b = len(a), len(b)
+    if skip is not None:
+        skip_set = frozenset(i for i in range(max(len_a, len_b)) if skip(i))
+    if not mapping:
+        # Pair up the common part with zip and deal with whichever tail is
+        # left over in one go; no index checks or nil tests per element
+        n = min(len_a, len_b)
+        changed.extend([(i, x, y) for i, (x, y)
+                        in enumerate(zip(a, b))
+                        if i not in skip_set and not cmp(x, y)])
+        deleted.extend([(i, a[i]) for i in range(n, len_a)
+                        if i not in skip_set])
+        added.extend([(i, b[i]) for i in range(n, len_b)
+                      if i not in skip_set])
+        return
+    for i in range(max(len_a, len_b)):
+        if i in skip_set:
             continue
-        try:
-            x = a[i]
-        except IndexError:
-            x = nil
-        try:
-            j = mapping[i]
-        except KeyError:
-            j = i
-        try:    
-            y = b[j]
-        except IndexError:
-            y = nil
+        x = a[i] if i < len_a else _nil
+        j = _mget(i, i)
+        y = b[j] if j < len_b else _nil
         if not cmp(x, y):			
-            diffs.append((i, x, y))
-    return diffs
+            if x is _nil:
+                _add((i, y))
+            elif y is _nil:
+                _delete((i, x))
+            else:
+                _change((i, x, y))
+
+class _TooManyEdits(Exception):
+    pass
+
+def _middle_snake(a, a0, n, b, b0, m, max_d):
+    """
+    Find the middle snake of the shortest edit script between
+    a[a0:a0+n] and b[b0:b0+m], searching forwards and backwards at once
+    Returns: (d, x, y, u, v); d is the length of the edit script and the
+        snake runs from (x, y) to (u, v), relative to a0 and b0
+    """
+    delta = n - m
+    odd = delta & 1
+    forward = {1: 0}
+    backward = {1: 0}
+    for d in range((n + m + 1) // 2 + 1):
+        if d > max_d:
+            raise _TooManyEdits()
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[k - 1] < forward[k + 1]):
+                x = forward[k + 1]
+            else:
+                x = forward[k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[a0 + x] == b[b0 + y]:
+                x += 1
+                y += 1
+            forward[k] = x
+            if odd and delta - (d - 1) <= k <= delta + (d - 1) and \
+               x + backward[delta - k] >= n:
+                return 2 * d - 1, x0, y0, x, y
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and backward[k - 1] < backward[k + 1]):
+                x = backward[k + 1]
+            else:
+                x = backward[k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and \
+                  a[a0 + n - 1 - x] == b[b0 + m - 1 - y]:
+                x += 1
+                y += 1
+            backward[k] = x
+            if not odd and -d <= delta - k <= d and \
+               x + forward[delta - k] >= n:
+                return 2 * d, n - x, m - y, n - x0, m - y0
 
+def _myers_matches(a, a0, n, b, b0, m, max_d, matches):
+    """
+    Append the (i, j) index pairs of a longest common subsequence of
+    a[a0:a0+n] and b[b0:b0+m] onto matches, in order
+    """
+    if n == 0 or m == 0:
+        return
+    d, x, y, u, v = _middle_snake(a, a0, n, b, b0, m, max_d)
+    if d > 1:
+        _myers_matches(a, a0, x, b, b0, y, max_d, matches)
+        matches.extend((a0 + x + t, b0 + y + t) for t in range(u - x))
+        _myers_matches(a, a0 + u, n - u, b, b0 + v, m - v, max_d, matches)
+    else:
+        # At most one element was inserted or deleted, so walking both
+        # sequences together and stepping over it in the longer one
+        # pairs up everything else
+        i = j = 0
+        while i < n and j < m:
+            if a[a0 + i] == b[b0 + j]:
+                matches.append((a0 + i, b0 + j))
+                i += 1
+                j += 1
+            elif n > m:
+                i += 1
+            else:
+                j += 1
+
+def myers_opcodes(a, b, max_edits=None):
+    """
+    a and b (indexable, finite sequences of hashable or comparable items)
+    max_edits (int): give up if the edit script would be longer
+
+    Returns: list of opcodes in the same form as
+        difflib.SequenceMatcher.get_opcodes(), or None if a and b need
+        more than max_edits insertions and deletions
+
+    Uses the linear space variant of Myers' O(ND) algorithm ("An O(ND)
+    Difference Algorithm and Its Variations", 1986), so the edit script
+    is as short as possible and the cost grows with how different the
+    sequences are rather than with their length.
+    """
+    n, m = len(a), len(b)
+    if max_edits is None:
+        max_edits = n + m
+    matches = []
+    try:
+        # Searching to depth d finds scripts of up to 2 * d edits, so this
+        # gives up early only when the script is sure to be too long
+        _myers_matches(a, 0, n, b, 0, m, (max_edits + 1) // 2, matches)
+    except _TooManyEdits:
+        return None
+    # The search depth can't tell max_edits + 1 edits from max_edits, and
+    # an empty side needs no search at all, so check the exact length
+    if n + m - 2 * len(matches) > max_edits:
+        return None
+    opcodes = []
+    i = j = 0
+    for x, y in matches + [(n, m)]:
+        if x > i and y > j:
+            opcodes.append(("replace", i, x, j, y))
+        elif x > i:
+            opcodes.append(("delete", i, x, j, y))
+        elif y > j:
+            opcodes.append(("insert", i, x, j, y))
+        if x < n and y < m:
+            if opcodes and opcodes[-1][0] == "equal":
+                opcodes[-1] = ("equal", opcodes[-1][1], x + 1,
+                               opcodes[-1][3], y + 1)
+            else:
+                opcodes.append(("equal", x, x + 1, y, y + 1))
+        i, j = x + 1, y + 1
+    return opcodes
 
 ################################################################
 #
@@ -335,86 +1025,232 @@ def diff_seq_by_index(a, b,
 #
 ################################################################
 def setup_options():
-    USAGE = "%prog [options] a.csv b.csv"
-    parser = optparse.OptionParser(USAGE)
-    parser.add_option('-l', '--label',
-                      action="store_true",  
-                      dest="label_first_row",
-                      default=False,
-                      help="first row of data represents field labels")
-    parser.add_option('-s', '--skip-fields',
-                      action="store",  
-                      dest="skipped_fields",
-                      help="fields to skip (comma separated, use"
-                           " @field_number or field_label if using -l)")
-    parser.add_option('-i', '--ignore-case',
-                      action="store_true",  
-                      dest="ignore_case",
-                      default=False,
-                      help="ignore case when comparing field names and data")
-    parser.add_option('-g', '--ignore-order',
-                      action="store_true",  
-                      dest="ignore_order",
-                      default=False,
-                      help="ignore the order of the columns if using labels")
-    parser.add_option('-o', '--only-fields',
-                      action="store",  
-                      dest="only_fields",
-                      help="use only these fields (same syntax as skip)")
-    parser.add_option('-v', '--verbosity',
-                      action="store",
-                      type="int", 
-                      dest="verbosity",
-                      default=2,
-                      help="level of verbosity to use (default: 2)")
-    parser.add_option('--run-tests',
-                      action="store_true",  
-                      dest="run_tests",
-                      help="run the test suite")
-
-    options, args = parser.parse_args()
+    USAGE = "%(prog)s [options] a.csv b.csv [a2.csv b2.csv ...]"
+    parser = argparse.ArgumentParser(usage=USAGE)
+    parser.add_argument('files', nargs="*", help=argparse.SUPPRESS)
+    parser.add_argument('-l', '--label',
+                        action="store_true",  
+                        dest="label_first_row",
+                        default=False,
+                        help="first row of data represents field labels")
+    parser.add_argument('-s', '--skip-fields',
+                        action="store",  
+                        dest="skipped_fields",
+                        help="fields to skip (comma separated, use"
+                             " @field_number or field_label if using -l)")
+    parser.add_argument('-i', '--ignore-case',
+                        action="store_true",  
+                        dest="ignore_case",
+                        default=False,
+                        help="ignore case when comparing field names and data")
+    parser.add_argument('-g', '--ignore-order',
+                        action="store_true",  
+                        dest="ignore_order",
+                        default=False,
+                        help="ignore the order of the columns if using labels")
+    parser.add_argument('-o', '--only-fields',
+                        action="store",  
+                        dest="only_fields",
+                        help="use only these fields (same syntax as skip)")
+    parser.add_argument('-c', '--columnar',
+                        action="store_true",  
+                        dest="columnar",
+                        default=False,
+                        help="load both files into memory and compare them"
+                             " column by column (faster for wide files)")
+    parser.add_argument('-j', '--jobs',
+                        action="store",
+                        type=int, 
+                        dest="jobs",
+                        default=1,
+                        help="number of processes to parse and diff"
+                             " with (default: 1)")
+    parser.add_argument('-p', '--parallel',
+                        action="store",
+                        type=int,
+                        dest="parallel",
+                        default=1,
+                        help="number of file pairs to diff at once when"
+                             " more than one pair is given (default: 1)")
+    parser.add_argument('--hash-diff',
+                        action="store_true",  
+                        dest="hash_diff",
+                        default=False,
+                        help="match rows up by content before diffing, so"
+                             " inserted or deleted rows aren't reported as"
+                             " changes to every row after them")
+    parser.add_argument('-k', '--key',
+                        action="store",
+                        dest="key_fields",
+                        help="fields that identify a row (same syntax as"
+                             " skip); rows are matched up by key instead of"
+                             " by position, so row order doesn't matter")
+    parser.add_argument('-v', '--verbosity',
+                        action="store",
+                        type=int, 
+                        dest="verbosity",
+                        default=2,
+                        help="level of verbosity to use (default: 2)")
+    parser.add_argument('--run-tests',
+                        action="store_true",  
+                        dest="run_tests",
+                        help="run the test suite")
+
+    options = parser.parse_args()
+    args = options.files
     if len(args) < 2 and not options.run_tests:
         help(parser)
+    if len(args) % 2:
+        help(parser, "Files must be given in pairs!")
 
     if options.ignore_order and not options.label_first_row:
         help(parser, "--ignore-order only makes sense for labeled tables!")
+    if options.key_fields and options.hash_diff:
+        help(parser, "--key and --hash-diff can't be used together!")
     return options, args
 
-def get_table_from_csv(data, fields=None, label_first_row=False):
+def open_csv(path):
+    """
+    Files are opened in text mode with newline="" as the csv module
+    requires, so quoted fields may hold newlines. Undecodable bytes are
+    kept as surrogates rather than raising, so any file can be diffed.
+    """
+    f = open(path, "r", READ_BUFFER_SIZE, encoding="utf-8",
+             errors="surrogateescape", newline="")
+    if hasattr(os, "posix_fadvise"):
+        # The file is read once, front to back: ask for aggressive readahead
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    return f
+
+def get_table_from_csv(data, fields=None, label_first_row=False,
+                       columnar=False):
     return Table(csv.reader(data), fields=fields, 
-                 label_first_row=label_first_row)	
+                 label_first_row=label_first_row, columnar=columnar)	
+
+def _parse_block(task):
+    """
+    Worker for read_csv_blocks; parses the rows in one byte range of a file
+    task (tuple): (path, start, end)
+    """
+    path, start, end = task
+    f = open(path, "rb")
+    try:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            text = mm[start:end].decode("utf-8", "surrogateescape")
+            return list(csv.reader(io.StringIO(text, newline="")))
+        finally:
+            mm.close()
+    finally:
+        f.close()
+
+def read_csv_blocks(path, jobs):
+    """
+    Split a memory-mapped csv file into `jobs` blocks on line boundaries
+    and parse the blocks in a pool of worker processes
+    path (str): csv file to read
+    jobs (int): number of worker processes
+    Returns: list of rows, or None if the file is smaller than
+        PARALLEL_MIN_BYTES or contains quotes (a quoted field may hold a
+        newline, so the file can't be split safely)
+    """
+    f = open(path, "rb")
+    try:
+        size = os.fstat(f.fileno()).st_size
+        if size < PARALLEL_MIN_BYTES:
+            return None
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if mm.find(b'"') != -1:
+                return None
+            bounds = [0]
+            for k in range(1, jobs):
+                offset = mm.find(b'\n', max(k * size // jobs, bounds[-1]))
+                bounds.append(size if offset == -1 else offset + 1)
+            bounds.append(size)
+        finally:
+            mm.close()
+    finally:
+        f.close()
+
+    tasks = [(path, start, end) for start, end in zip(bounds, bounds[1:])
+             if end > start]
+    pool = multiprocessing.Pool(jobs)
+    try:
+        blocks = pool.map(_parse_block, tasks)
+    finally:
+        pool.close()
+        pool.join()
+    # Extending by whole lists sizes the result once per block, rather
+    # than growing it geometrically one row at a time
+    rows = []
+    for block in blocks:
+        rows.extend(block)
+    return rows
+
+def get_table_from_path(path, label_first_row=False, columnar=False,
+                        jobs=1):
+    if jobs > 1:
+        rows = read_csv_blocks(path, jobs)
+        if rows is not None:
+            return Table(rows, label_first_row=label_first_row,
+                         columnar=columnar)
+    return get_table_from_csv(open_csv(path),
+                              label_first_row=label_first_row,
+                              columnar=columnar)
 
 def help(parser, data=None, out=sys.stdout, errcode=1):
     parser.print_help()
     if data is not None:
-        print >>out, '\n' + data
+        print('\n' + data, file=out)
     sys.exit(errcode)
     
-def fatal(data, errcode=1, out=sys.stderr):
-    print >>out, data
+def fatal(data, errcode=1, out=None):
+    print(data, file=out or sys.stderr)
     sys.exit(errcode)
 
 def get_files(args):
-    file_a, file_b = args
-    for file in (file_a, file_b):
+    for file in args:
         if not os.path.exists(file):
             fatal("file '%s' not found" % file)
-    return file_a, file_b
+    return list(zip(args[::2], args[1::2]))
+
+def check_key_fields(key_fields, table_a, table_b):
+    """
+    key_fields (set): field numbers parsed from --key
+    Returns: sorted list of the key field numbers; exits with an error if
+        one is past the last field of either table
+    """
+    key_fields = sorted(key_fields or [])
+    for table_num, table in ((1, table_a), (2, table_b)):
+        for field in key_fields:
+            if field >= len(table.fields):
+                fatal("Key field @%i not found in table %i, which has %i"
+                      " fields" % (field, table_num, len(table.fields)))
+    return key_fields
 
 def parse_fieldlist(fieldlist, table_a, table_b):
-    def get_field_num(fieldname, table, table_num):
-        matches = [(i, f) for i, f in enumerate(table.fields)
-                   if f == fieldname]
-        num_matches = len(matches)
-        if num_matches == 1:
-            return matches[0][0]
-        elif num_matches > 1:
-            fatal("Multiple fields found in table %i named '%s'. Use"
-                  "field numbers to disambiguate" % (table_num, fieldname))
-        else:
+    ambiguous = object()
+
+    def get_field_num(fieldname, lookup, table_num):
+        field_num = lookup.get(fieldname)
+        if field_num is None:
             fatal("Field '%s' not found in table %i" % (fieldname, table_num))
+        elif field_num is ambiguous:
+            fatal("Multiple fields found in table %i named '%s'. Use"
+                  " field numbers to disambiguate" % (table_num, fieldname))
+        return field_num
+
+    def build_lookup(table):
+        # Index of each label, or `ambiguous` if the label is repeated
+        lookup = {}
+        for i, f in enumerate(table.fields):
+            lookup[f] = ambiguous if f in lookup else i
+        return lookup
 
     if fieldlist:
+        lookup_a = build_lookup(table_a)
+        lookup_b = build_lookup(table_b)
         fieldset = set()
         for field in [i.strip() for i in fieldlist.split(',')]:
             if field.startswith('@'):
@@ -425,8 +1261,8 @@ def parse_fieldlist(fieldlist, table_a, table_b):
                     fatal("Unable to parse field number '%s'" % field)
                 fieldset.add(field)
             elif field:
-                field_num_a = get_field_num(field, table_a, 1)
-                field_num_b = get_field_num(field, table_b, 2)
+                field_num_a = get_field_num(field, lookup_a, 1)
+                field_num_b = get_field_num(field, lookup_b, 2)
                 assert field_num_a == field_num_b
                 fieldset.add(field_num_a)
         return fieldset
@@ -438,34 +1274,94 @@ def run_tests():
     result = test_runner.run(test_suite)
     return not result.wasSuccessful()
 
-def main():
-    options, args = setup_options()
-
-    if options.run_tests:
-        return run_tests()
-    
-    file_a, file_b = get_files(args)
-    table_a = get_table_from_csv(open(file_a, "rb"), 
-                                 label_first_row=options.label_first_row)
-    table_b = get_table_from_csv(open(file_b, "rb"), 
-                                 label_first_row=options.label_first_row)
+def diff_files(file_a, file_b, options, out=sys.stdout):
+    """
+    Diff two csv files and pretty print the results
+    options (Namespace): parsed command line options
+    Returns: True if a difference was detected
+    """
+    table_a = get_table_from_path(file_a, 
+                                  label_first_row=options.label_first_row,
+                                  columnar=options.columnar,
+                                  jobs=options.jobs)
+    table_b = get_table_from_path(file_b, 
+                                  label_first_row=options.label_first_row,
+                                  columnar=options.columnar,
+                                  jobs=options.jobs)
 
     skipped_fields = parse_fieldlist(options.skipped_fields, table_a, 
                                      table_b)
     only_fields = parse_fieldlist(options.only_fields, table_a, table_b)
+    key_fields = check_key_fields(parse_fieldlist(options.key_fields,
+                                                  table_a, table_b),
+                                  table_a, table_b)
     
     differ = TableDiffer(table_a, table_b, 
                          skipped_fields=skipped_fields,
                          verbosity=options.verbosity,
                          ignore_case=options.ignore_case,
                          only_fields=only_fields,
-                         ignore_order=options.ignore_order)
+                         ignore_order=options.ignore_order,
+                         jobs=options.jobs,
+                         hash_diff=options.hash_diff,
+                         key_fields=key_fields)
     
-    # Diff the tables and pretty print the results to stdout 
-    differ.pprint_diff()
+    differ.pprint_diff(out=out)
+    return differ.difference_detected
+
+def _diff_pair(task):
+    """
+    Worker for main when several file pairs are given; diffs one pair
+    task (tuple): (options, file_a, file_b)
+    Returns: (exit code, diff output)
+    """
+    options, file_a, file_b = task
+    out = io.StringIO()
+    try:
+        errcode = int(diff_files(file_a, file_b, options, out=out))
+    except SystemExit as e:
+        # fatal() has already reported the problem on stderr
+        errcode = e.code
+    return errcode, out.getvalue()
+
+def main():
+    options, args = setup_options()
+
+    if options.run_tests:
+        return run_tests()
     
-    # 0 means no-difference/tests passed, 1 means differences/tests failed
-    return int(differ.difference_detected)
+    pairs = get_files(args)
+    if len(pairs) == 1:
+        # Diff the tables and pretty print the results to stdout 
+        file_a, file_b = pairs[0]
+        # 0 means no-difference/tests passed, 1 means differences/tests failed
+        return int(diff_files(file_a, file_b, options))
+
+    # Each pair is diffed into its own buffer and printed in the order
+    # given. Pool workers can't start pools of their own, so --jobs only
+    # applies within a pair when pairs are diffed one at a time.
+    if options.parallel > 1:
+        options.jobs = 1
+    tasks = [(options, file_a, file_b) for file_a, file_b in pairs]
+    pool = None
+    if options.parallel > 1:
+        pool = multiprocessing.Pool(min(options.parallel, len(tasks)))
+        results = pool.imap(_diff_pair, tasks)
+    else:
+        results = map(_diff_pair, tasks)
+    errcode = 0
+    try:
+        for (file_a, file_b), (code, data) in zip(pairs, results):
+            if data:
+                sys.stdout.write("Files '%s' and '%s' differ\n%s"
+                                 % (file_a, file_b, data))
+                sys.stdout.flush()
+            errcode = max(errcode, code)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return errcode
     
 ################################################################
 #
@@ -476,9 +1372,27 @@ class TestTable(unittest.TestCase):
     def test_autonamed_fields(self):
         t = Table(rows=[(1,2,3), (4,5,6)])
         self.assertEqual(t.fields, ("@0", "@1", "@2"))
+    def test_autonamed_fields_rows(self):
+        t = Table(rows=[(1,2,3), (4,5,6)])
+        self.assertEqual(list(t.rows), [(1,2,3), (4,5,6)])
+    def test_labeled_fields(self):
+        t = Table(rows=[("id", "name"), (1, 2)], label_first_row=True)
+        self.assertEqual(t.fields, ("id", "name"))
+        self.assertEqual(list(t.rows), [(1, 2)])
+    def test_empty(self):
+        t = Table(rows=[])
+        self.assertEqual(t.fields, ())
+        self.assertEqual(list(t.rows), [])
     def test_named_fields(self):
         t = Table(rows=[(1,2,3), (4,5,6)], fields=("id", "name", "occupation"))
         self.assertEqual(t.fields, ("id", "name", "occupation"))
+    def test_columnar(self):
+        t = Table(rows=[(1,2,3), (4,5,6)], columnar=True)
+        self.assertEqual(t.columns, [(1,4), (2,5), (3,6)])
+    def test_columnar_ragged(self):
+        t = Table(rows=[(1,2,3), (4,5)], columnar=True)
+        self.assertEqual(t.columns, None)
+        self.assertEqual(t.rows, [(1,2,3), (4,5)])
 
 class TestDiffSeqByIndex(unittest.TestCase):
     def assertDiff(self, a, b, expected):
@@ -516,6 +1430,40 @@ class TestDiffSeqByIndexMapping(unittest.TestCase):
                         [(2, 3, 4), (3, nil, 5)],
                         mapping=[])
         
+class TestMyersOpcodes(unittest.TestCase):
+    def assertOpcodes(self, a, b, expected, max_edits=None):
+        self.assertEqual(myers_opcodes(a, b, max_edits=max_edits), expected)
+    def test_same(self):
+        self.assertOpcodes("abc", "abc", [("equal", 0, 3, 0, 3)])
+    def test_empty(self):
+        self.assertOpcodes("", "ab", [("insert", 0, 0, 0, 2)])
+        self.assertOpcodes("ab", "", [("delete", 0, 2, 0, 0)])
+    def test_inserted(self):
+        self.assertOpcodes("ac", "abc", 
+                           [("equal", 0, 1, 0, 1), ("insert", 1, 1, 1, 2),
+                            ("equal", 1, 2, 2, 3)])
+    def test_replaced(self):
+        self.assertOpcodes("abc", "axc", 
+                           [("equal", 0, 1, 0, 1), ("replace", 1, 2, 1, 2),
+                            ("equal", 2, 3, 2, 3)])
+    def test_shortest(self):
+        opcodes = myers_opcodes("abcabba", "cbabac")
+        matched = sum(i2 - i1 for tag, i1, i2, j1, j2 in opcodes
+                      if tag == "equal")
+        self.assertEqual(matched, 4)
+    def test_max_edits(self):
+        self.assertOpcodes("abc", "xyz", None, max_edits=3)
+        self.assertOpcodes("abc", "xyz", [("replace", 0, 3, 0, 3)],
+                           max_edits=6)
+    def test_max_edits_boundary(self):
+        self.assertOpcodes("abc", "xyz", None, max_edits=5)
+        self.assertOpcodes("ac", "abc",
+                           [("equal", 0, 1, 0, 1), ("insert", 1, 1, 1, 2),
+                            ("equal", 1, 2, 2, 3)], max_edits=1)
+        self.assertOpcodes("ac", "abc", None, max_edits=0)
+        self.assertOpcodes("", "ab", [("insert", 0, 0, 0, 2)], max_edits=2)
+        self.assertOpcodes("", "ab", None, max_edits=1)
+
 class TestTableDifferDiffFields(unittest.TestCase):
     def assertFieldDiffs(self, table_a, table_b, added, deleted, changed):
         self.assertEqual(TableDiffer(table_a, table_b).diff_fields(),
@@ -550,6 +1498,12 @@ class TestTableDifferDiffRows(unittest.TestCase):
         table_a = Table(rows=[("a", "b", "c")], fields=(1, 2, 3))
         table_b = Table(rows=[("a", "b", "c")], fields=(1, 2, 3))
         self.assertRowDiffs(table_a, table_b, [])	
+    def test_ragged_row(self):
+        table_a = Table(rows=[("a", "b"), ("c",)], fields=(1, 2))
+        table_b = Table(rows=[("a", "b"), ("c", "d")], fields=(1, 2))
+        self.assertRowDiffs(table_a, table_b,
+                            [("changed", 1, ("c",), ("c", "d"),
+                              [(1, nil, "d")])])
     def test_added(self):
         table_a = Table(rows=[("a", "b", "c")], fields=(1, 2, 3))
         table_b = Table(rows=[("a", "b", "c"), ("e", "f", "g")], 
@@ -580,9 +1534,285 @@ class TestTableDifferDiffRows(unittest.TestCase):
                               ("added", 1, ("e", "f", "g"))])
 
 
+class TestTableDifferDiffRowsColumnar(unittest.TestCase):
+    def assertRowDiffs(self, table_a, table_b, expected):
+        results = list(TableDiffer(table_a, table_b).diff_rows_columnar())
+        self.assertEqual(results, expected)	
+    def test_ragged(self):
+        table_a = Table(rows=[("a", "b"), ("c", "d")], columnar=True)
+        table_b = Table(rows=[("a", "b"), ("c", "d", "e")], columnar=True)
+        self.assertRowDiffs(table_a, table_b,
+                            [("changed", 1, ("c", "d"), ("c", "d", "e"),
+                              [(2, nil, "e")])])
+        self.assertRowDiffs(table_b, table_a,
+                            [("changed", 1, ("c", "d", "e"), ("c", "d"),
+                              [(2, "e", nil)])])
+        table_c = Table(rows=[("a", "b"), ("c",)], columnar=True)
+        self.assertRowDiffs(table_a, table_c,
+                            [("changed", 1, ("c", "d"), ("c",),
+                              [(1, "d", nil)])])
+    def test_same(self):
+        table_a = Table(rows=[("a", "b", "c")], fields=(1, 2, 3),
+                        columnar=True)
+        table_b = Table(rows=[("a", "b", "c")], fields=(1, 2, 3),
+                        columnar=True)
+        self.assertRowDiffs(table_a, table_b, [])	
+    def test_added(self):
+        table_a = Table(rows=[("a", "b", "c")], fields=(1, 2, 3),
+                        columnar=True)
+        table_b = Table(rows=[("a", "b", "c"), ("e", "f", "g")], 
+                        fields=(1, 2, 3), columnar=True)
+        self.assertRowDiffs(table_a, table_b, 
+                            [("added", 1, ("e", "f", "g"))])
+    def test_deleted(self):
+        table_a = Table(rows=[("a", "b", "c"), ("e", "f", "g")], 
+                        fields=(1, 2, 3), columnar=True)
+        table_b = Table(rows=[("a", "b", "c")], fields=(1, 2, 3),
+                        columnar=True)
+        self.assertRowDiffs(table_a, table_b, 
+                            [("deleted", 1, ("e", "f", "g"))])
+    def test_changed(self):
+        table_a = Table(rows=[("a", "b", "c"), ("d", "e", "f")],
+                        fields=(1, 2, 3), columnar=True)
+        table_b = Table(rows=[("a", "x", "d"), ("d", "e", "f")],
+                        fields=(1, 2, 3), columnar=True)
+        self.assertRowDiffs(table_a, table_b, 
+                            [("changed", 0, 
+                              ("a", "b", "c"), ("a", "x", "d"), 
+                              [(1, "b", "x"), (2, "c", "d")])])
+    def test_added_changed(self):
+        table_a = Table(rows=[("a", "b", "c")], fields=(1, 2, 3),
+                        columnar=True)
+        table_b = Table(rows=[("a", "b", "d"), ("e", "f", "g")], 
+                        fields=(1, 2, 3), columnar=True)
+        self.assertRowDiffs(table_a, table_b, 
+                            [("changed", 0, 
+                              ("a", "b", "c"), ("a", "b", "d"), 
+                              [(2, "c", "d")]),
+                              ("added", 1, ("e", "f", "g"))])
+
+
+class TestTableDifferDiffRowsParallel(unittest.TestCase):
+    def assertRowDiffs(self, table_a, table_b, expected):
+        differ = TableDiffer(table_a, table_b)
+        results = list(differ.diff_rows_parallel(jobs=2, min_rows=1))
+        self.assertEqual(results, expected)	
+    def test_same(self):
+        table_a = Table(rows=[("a", "b", "c")], fields=(1, 2, 3))
+        table_b = Table(rows=[("a", "b", "c")], fields=(1, 2, 3))
+        self.assertRowDiffs(table_a, table_b, [])	
+    def test_added_changed(self):
+        table_a = Table(rows=[("a", "b", "c"), ("d", "e", "f")],
+                        fields=(1, 2, 3))
+        table_b = Table(rows=[("a", "b", "c"), ("d", "e", "g"),
+                              ("h", "i", "j")], fields=(1, 2, 3))
+        self.assertRowDiffs(table_a, table_b, 
+                            [("changed", 1, 
+                              ("d", "e", "f"), ("d", "e", "g"), 
+                              [(2, "f", "g")]),
+                              ("added", 2, ("h", "i", "j"))])
+
+
+class TestTableDifferDiffRowsAligned(unittest.TestCase):
+    def assertRowDiffs(self, table_a, table_b, expected, **kwargs):
+        differ = TableDiffer(table_a, table_b, hash_diff=True, **kwargs)
+        results = list(differ.diff_rows_aligned())
+        self.assertEqual(results, expected)	
+    def test_same(self):
+        table_a = Table(rows=[("a", "b", "c")], fields=(1, 2, 3))
+        table_b = Table(rows=[("a", "b", "c")], fields=(1, 2, 3))
+        self.assertRowDiffs(table_a, table_b, [])	
+    def test_inserted(self):
+        table_a = Table(rows=[("a", "b", "c"), ("h", "i", "j")],
+                        fields=(1, 2, 3))
+        table_b = Table(rows=[("e", "f", "g"), ("a", "b", "c"),
+                              ("h", "i", "j")], fields=(1, 2, 3))
+        self.assertRowDiffs(table_a, table_b, 
+                            [("added", 0, ("e", "f", "g"))])
+    def test_deleted(self):
+        table_a = Table(rows=[("a", "b", "c"), ("e", "f", "g"),
+                              ("h", "i", "j")], fields=(1, 2, 3))
+        table_b = Table(rows=[("a", "b", "c"), ("h", "i", "j")],
+                        fields=(1, 2, 3))
+        self.assertRowDiffs(table_a, table_b, 
+                            [("deleted", 1, ("e", "f", "g"))])
+    def test_changed(self):
+        table_a = Table(rows=[("a", "b", "c"), ("h", "i", "j")],
+                        fields=(1, 2, 3))
+        table_b = Table(rows=[("a", "b", "d"), ("h", "i", "j")],
+                        fields=(1, 2, 3))
+        self.assertRowDiffs(table_a, table_b, 
+                            [("changed", 0, 
+                              ("a", "b", "c"), ("a", "b", "d"), 
+                              [(2, "c", "d")])])
+    def test_repeated_rows(self):
+        table_a = Table(rows=[("a",), ("a",), ("a",)], fields=(1,))
+        table_b = Table(rows=[("a",), ("a",)], fields=(1,))
+        self.assertRowDiffs(table_a, table_b, [("deleted", 2, ("a",))])
+        table_a = Table(rows=[("a",), ("b",), ("a",)], fields=(1,))
+        table_b = Table(rows=[("a",), ("c",), ("d",), ("a",)], fields=(1,))
+        self.assertRowDiffs(table_a, table_b, 
+                            [("changed", 1, ("b",), ("c",), [(0, "b", "c")]),
+                             ("added", 2, ("d",))])
+    def test_ignore_case(self):
+        table_a = Table(rows=[("a", "b", "c"), ("h", "i", "j")],
+                        fields=(1, 2, 3))
+        table_b = Table(rows=[("e", "f", "g"), ("A", "B", "C"),
+                              ("h", "i", "j")], fields=(1, 2, 3))
+        self.assertRowDiffs(table_a, table_b, 
+                            [("added", 0, ("e", "f", "g"))],
+                            ignore_case=True)
+    def test_skipped_fields(self):
+        table_a = Table(rows=[("a", "b"), ("c", "d")], fields=(1, 2))
+        table_b = Table(rows=[("e", "f"), ("a", "x"), ("c", "y")],
+                        fields=(1, 2))
+        self.assertRowDiffs(table_a, table_b,
+                            [("added", 0, ("e", "f"))],
+                            skipped_fields=[1])
+    def test_ragged_rows(self):
+        table_a = Table(rows=[("a", "b"), ("c",)], fields=(1, 2))
+        table_b = Table(rows=[("x", "b"), ("c", "d")], fields=(1, 2))
+        self.assertRowDiffs(table_a, table_b,
+                            [("changed", 0, ("a", "b"), ("x", "b"),
+                              [(0, "a", "x")]),
+                             ("deleted", 1, ("c",)),
+                             ("added", 1, ("c", "d"))])
+    def test_difference_detected(self):
+        table_a = Table(rows=[("1", "2"), ("5", "6")], fields=(1, 2))
+        table_b = Table(rows=[("1", "2"), ("3", "4"), ("5", "6")],
+                        fields=(1, 2))
+        differ = TableDiffer(table_a, table_b, hash_diff=True)
+        self.assertEqual(list(differ.diff_rows_aligned()),
+                         [("added", 1, ("3", "4"))])
+        self.assertTrue(differ.difference_detected)
+    def test_skipped_added_field(self):
+        table_a = Table(rows=[("a", "b"), ("c", "d")], fields=(1, 2))
+        table_b = Table(rows=[("e", "f", "g"), ("a", "b", "1"),
+                              ("c", "x", "2")], fields=(1, 2, 3))
+        self.assertRowDiffs(table_a, table_b,
+                            [("added", 0, ("e", "f", "g")),
+                             ("changed", 1, ("c", "d"), ("c", "x", "2"),
+                              [(1, "d", "x")])],
+                            skipped_fields=[2])
+
+
+class TestTableDifferDiffRowsKeyed(unittest.TestCase):
+    def assertRowDiffs(self, table_a, table_b, expected, **kwargs):
+        differ = TableDiffer(table_a, table_b, **kwargs)
+        results = list(differ.diff_rows_keyed())
+        self.assertEqual(results, expected)
+    def test_reordered(self):
+        table_a = Table(rows=[("1", "a"), ("2", "b")], fields=(1, 2))
+        table_b = Table(rows=[("2", "b"), ("1", "a")], fields=(1, 2))
+        self.assertRowDiffs(table_a, table_b, [], key_fields=[0])
+    def test_changed(self):
+        table_a = Table(rows=[("1", "a"), ("2", "b")], fields=(1, 2))
+        table_b = Table(rows=[("2", "c"), ("1", "a")], fields=(1, 2))
+        self.assertRowDiffs(table_a, table_b,
+                            [("changed", 1, ("2", "b"), ("2", "c"),
+                              [(1, "b", "c")])],
+                            key_fields=[0])
+    def test_added_deleted(self):
+        table_a = Table(rows=[("1", "a"), ("2", "b")], fields=(1, 2))
+        table_b = Table(rows=[("3", "c"), ("1", "a")], fields=(1, 2))
+        self.assertRowDiffs(table_a, table_b,
+                            [("deleted", 1, ("2", "b")),
+                             ("added", 0, ("3", "c"))],
+                            key_fields=[0])
+    def test_repeated_keys(self):
+        table_a = Table(rows=[("1", "a"), ("1", "b")], fields=(1, 2))
+        table_b = Table(rows=[("1", "a"), ("1", "c"), ("1", "d")],
+                        fields=(1, 2))
+        self.assertRowDiffs(table_a, table_b,
+                            [("changed", 1, ("1", "b"), ("1", "c"),
+                              [(1, "b", "c")]),
+                             ("added", 2, ("1", "d"))],
+                            key_fields=[0])
+    def test_ignore_case(self):
+        table_a = Table(rows=[("a", "x", "1")], fields=(1, 2, 3))
+        table_b = Table(rows=[("A", "X", "2")], fields=(1, 2, 3))
+        self.assertRowDiffs(table_a, table_b,
+                            [("changed", 0, ("a", "x", "1"),
+                              ("A", "X", "2"), [(2, "1", "2")])],
+                            key_fields=[0, 1], ignore_case=True)
+    def test_short_rows(self):
+        table_a = Table(rows=[("1",), ("2", "b")], fields=(1, 2))
+        table_b = Table(rows=[("1", "a"), ("2",)], fields=(1, 2))
+        self.assertRowDiffs(table_a, table_b,
+                            [("deleted", 0, ("1",)),
+                             ("deleted", 1, ("2", "b")),
+                             ("added", 0, ("1", "a")),
+                             ("added", 1, ("2",))],
+                            key_fields=[0])
+        self.assertRowDiffs(table_a, table_b,
+                            [("deleted", 0, ("1",)),
+                             ("deleted", 1, ("2", "b")),
+                             ("added", 0, ("1", "a")),
+                             ("added", 1, ("2",))],
+                            key_fields=[1])
+
+
+class TestDiffFilesExitCode(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+    def assertDetected(self, data_a, data_b, expected, **options):
+        paths = []
+        for name, data in (("a.csv", data_a), ("b.csv", data_b)):
+            paths.append(os.path.join(self.dir, name))
+            with open(paths[-1], "w") as f:
+                f.write(data)
+        settings = dict(label_first_row=False, columnar=False, jobs=1,
+                        skipped_fields=None, only_fields=None,
+                        key_fields=None, verbosity=0, ignore_case=False,
+                        ignore_order=False, hash_diff=False)
+        settings.update(options)
+        detected = diff_files(paths[0], paths[1],
+                              argparse.Namespace(**settings))
+        self.assertEqual(detected, expected)
+    def test_same(self):
+        self.assertDetected("1,2\n3,4\n", "1,2\n3,4\n", False)
+        self.assertDetected("1,2\n3,4\n", "1,2\n3,4\n", False,
+                            hash_diff=True)
+    def test_inserted_hash_diff(self):
+        self.assertDetected("1,2\n5,6\n", "1,2\n3,4\n5,6\n", True,
+                            hash_diff=True)
+    def test_appended(self):
+        for options in ({}, {"ignore_case": True}, {"skipped_fields": "@1"},
+                        {"columnar": True}, {"jobs": 2}, {"key_fields": "@1"},
+                        {"hash_diff": True}):
+            self.assertDetected("1,2\n", "1,2\n3,4\n", True, **options)
+            self.assertDetected("1,2\n3,4\n", "1,2\n", True, **options)
+    def test_parallel_pool(self):
+        table_a = Table(rows=[("1", "2")] * 4, fields=(1, 2))
+        table_b = Table(rows=[("1", "2")] * 4 + [("3", "4")], fields=(1, 2))
+        differ = TableDiffer(table_a, table_b, verbosity=0)
+        self.assertEqual(list(differ.diff_rows_parallel(2, min_rows=0)),
+                         [("added", 4, ("3", "4"))])
+        self.assertTrue(differ.difference_detected)
+
+
+class TestCheckKeyFields(unittest.TestCase):
+    def test_in_range(self):
+        table_a = Table(rows=[("a", "b")], fields=(1, 2))
+        table_b = Table(rows=[("a", "b", "c")], fields=(1, 2, 3))
+        self.assertEqual(check_key_fields(set([1, 0]), table_a, table_b),
+                         [0, 1])
+    def test_out_of_range(self):
+        table_a = Table(rows=[("a", "b", "c")], fields=(1, 2, 3))
+        table_b = Table(rows=[("a", "b")], fields=(1, 2))
+        err = io.StringIO()
+        with contextlib.redirect_stderr(err):
+            self.assertRaises(SystemExit, check_key_fields, set([2]),
+                              table_a, table_b)
+        self.assertEqual(err.getvalue(), "Key field @2 not found in"
+                         " table 2, which has 2 fields\n")
+
+
 class TestTableDifferPPrintDiff(unittest.TestCase):
     def assertPPrintDiff(self, table_a, table_b, expected):
-        out = StringIO.StringIO()
+        out = io.StringIO()
         TableDiffer(table_a, table_b).pprint_diff(out=out)
         self.assertEqual(out.getvalue(), expected)
     def test_same(self):
@@ -612,6 +1842,16 @@ class TestTableDifferPPrintDiff(unittest.TestCase):
                         fields=(1, 2, 3))
         expected = "Row 0 changed\n    Value in field '3' changed: 'c' -> 'd'\n--------------------------------------------------\nRow 1 added\n('e', 'f', 'g')\n--------------------------------------------------\n"
         self.assertPPrintDiff(table_a, table_b, expected)
+    def test_ragged_long_row(self):
+        table_a = Table(rows=[("a", "b")], fields=(1, 2))
+        table_b = Table(rows=[("a", "b", "c")], fields=(1, 2))
+        expected = "Row 0 changed\n    Value in field '@2' changed: 'nil' -> 'c'\n--------------------------------------------------\n"
+        self.assertPPrintDiff(table_a, table_b, expected)
+    def test_field_changed(self):
+        table_a = Table(rows=[("a", "b", "c")], fields=(1, 2, 3))
+        table_b = Table(rows=[("a", "b", "c")], fields=(1, 2, 4))
+        expected = "Field changed: '3' -> '4'\nFields changed, skipping row diff!\n"
+        self.assertPPrintDiff(table_a, table_b, expected)
 
 
 class TestTableDifferSkippedFields(unittest.TestCase):
@@ -644,7 +1884,25 @@ class TestTableDifferSkippedFields(unittest.TestCase):
         self.assertFieldDiffs(table_a, table_b, [], [], [(2, 3, 4)],
                               skipped_fields=[3]) 
         self.assertFieldDiffs(table_a, table_b, [], [], [],
-                              skipped_fields=[2, 3]) 
+                              skipped_fields=[2, 3])
+    def test_rows_added_field(self):
+        table_a = Table(rows=[("a", "b", "c")], fields=(1, 2, 3))
+        table_b = Table(rows=[("a", "x", "c", "d")], fields=(1, 2, 3, 4))
+        differ = TableDiffer(table_a, table_b, skipped_fields=[3])
+        self.assertEqual(list(differ.diff_rows()),
+                         [("changed", 0, ("a", "b", "c"),
+                           ("a", "x", "c", "d"), [(1, "b", "x")])])
+    def test_rows_ragged(self):
+        table_a = Table(rows=[("a", "b"), ("c", "d")], fields=(1, 2))
+        table_b = Table(rows=[("a", "b"), ("c",)], fields=(1, 2))
+        differ = TableDiffer(table_a, table_b, skipped_fields=[0])
+        self.assertEqual(list(differ.diff_rows()),
+                         [("changed", 1, ("c", "d"), ("c",),
+                           [(1, "d", nil)])])
+        differ = TableDiffer(table_b, table_a, skipped_fields=[0])
+        self.assertEqual(list(differ.diff_rows()),
+                         [("changed", 1, ("c",), ("c", "d"),
+                           [(1, nil, "d")])])
 
                               
 class TestTableDifferIgnoreCase(unittest.TestCase):
@@ -652,10 +1910,53 @@ class TestTableDifferIgnoreCase(unittest.TestCase):
         differ = TableDiffer(table_a, table_b, ignore_case=True)
         results = list(differ.diff_rows())
         self.assertEqual(results, expected)	
+    def test_ragged(self):
+        table_a = Table(rows=[("a", "b"), ("c", "d")], fields=(1, 2))
+        table_b = Table(rows=[("a", "b"), ("C",)], fields=(1, 2))
+        self.assertRowDiffs(table_a, table_b,
+                            [("changed", 1, ("c", "d"), ("C",),
+                              [(1, "d", nil)])])
+        self.assertRowDiffs(table_b, table_a,
+                            [("changed", 1, ("C",), ("c", "d"),
+                              [(1, nil, "d")])])
+    def test_ragged_nil_text(self):
+        table_a = Table(rows=[("a",)], fields=(1, 2))
+        table_b = Table(rows=[("a", "NIL")], fields=(1, 2))
+        self.assertRowDiffs(table_a, table_b,
+                            [("changed", 0, ("a",), ("a", "NIL"),
+                              [(1, nil, "NIL")])])
     def test_same(self):
         table_a = Table(rows=[("a", "b", "c")], fields=(1, 2, 3))
         table_b = Table(rows=[("a", "b", "C")], fields=(1, 2, 3))
         self.assertRowDiffs(table_a, table_b, [])
+    def test_changed(self):
+        table_a = Table(rows=[("a", "b", "c")], fields=(1, 2, 3))
+        table_b = Table(rows=[("A", "B", "D")], fields=(1, 2, 3))
+        self.assertRowDiffs(table_a, table_b,
+                            [("changed", 0,
+                              ("a", "b", "c"), ("A", "B", "D"),
+                              [(2, "c", "D")])])
+
+class TestTableDifferIgnoreCaseColumnar(unittest.TestCase):
+    def assertRowDiffs(self, table_a, table_b, expected):
+        differ = TableDiffer(table_a, table_b, ignore_case=True)
+        results = list(differ.diff_rows_columnar())
+        self.assertEqual(results, expected)	
+    def test_same(self):
+        table_a = Table(rows=[("a", "b", "c")], fields=(1, 2, 3),
+                        columnar=True)
+        table_b = Table(rows=[("a", "b", "C")], fields=(1, 2, 3),
+                        columnar=True)
+        self.assertRowDiffs(table_a, table_b, [])
+    def test_changed(self):
+        table_a = Table(rows=[("a", "b", "c")], fields=(1, 2, 3),
+                        columnar=True)
+        table_b = Table(rows=[("A", "B", "D")], fields=(1, 2, 3),
+                        columnar=True)
+        self.assertRowDiffs(table_a, table_b, 
+                            [("changed", 0, 
+                              ("a", "b", "c"), ("A", "B", "D"), 
+                              [(2, "c", "D")])])
 
 class TestTableDifferOnlyFields(unittest.TestCase):
     def assertFieldDiffs(self, table_a, table_b, added, deleted, changed,
@@ -715,8 +2016,15 @@ class TestTableDifferIgnoreOrder(unittest.TestCase):
         table_b = Table(rows=[("a", "d", "b")], fields=(1, 3, 2))
         self.assertRowDiffs(table_a, table_b, 
                             [("changed", 0, 
-                              ("a", "b", "c"), ("a", "d", "b"), 
+                              ("a", "b", "c"), ("a", "d", "b"),
                               [(2, "c", "d")])])
+    def test_changed_positionally_equal(self):
+        table_a = Table(rows=[("a", "b", "c")], fields=(1, 2, 3))
+        table_b = Table(rows=[("a", "b", "c")], fields=(1, 3, 2))
+        self.assertRowDiffs(table_a, table_b,
+                            [("changed", 0,
+                              ("a", "b", "c"), ("a", "b", "c"),
+                              [(1, "b", "c"), (2, "c", "b")])])
     def test_added_changed(self):
         table_a = Table(rows=[("a", "b", "c")], fields=(1, 2, 3))
         table_b = Table(rows=[("a", "d", "b"), ("e", "f", "g")], 